@@ -6,19 +6,12 @@ import re
 from enum import Enum
 import json
 
-import zmq
-import cv2
 import numpy as np
 from pyglui import ui
-import glfw
 
 from plugin import Plugin
-from methods import Roi
-from zmq_tools import Msg_Receiver
-from pupil_detectors import Detector_2D
-from vis_eye_video_overlay import get_ellipse_points
-from pyglui.cygl.utils import draw_gl_texture
-from gl_utils import clear_gl_screen, basic_gl_setup, make_coord_system_norm_based
+
+# Heavy modules (cv2, zmq, glfw, GL, detectors) are imported at the point of use.
 
 logger = logging.getLogger("preview")
 
@@ -87,6 +80,8 @@ class PreviewFrame:
         :param folder: The folder for storing the images.
         :param data: The image itself.
         """
+        import cv2
+
         cv2.imwrite(str(folder / str(self)), data)
 
     def load(self, folder: Path) -> np.ndarray:
@@ -95,6 +90,8 @@ class PreviewFrame:
         :param path: The folder for storing the images.
         :return: The loaded color image.
         """
+        import cv2
+
         return cv2.imread(str(Path(folder, str(self))))
 
     @staticmethod
@@ -139,6 +136,37 @@ class PreviewFrame:
 
 
 class PreviewGenerator:
+    COMMAND_STOP = "stop"
+    COMMAND_EXIT = "exit"
+
+    DEFAULT_DETECTOR_SETTINGS = {
+        "pupil_size_min": 40,
+        "pupil_size_max": 200,
+        "coarse_detection": False,
+    }
+
+    class Recording:
+        """
+        The settings of a single recording for which previews are generated.
+        """
+
+        def __init__(
+            self,
+            frame_per_frames: int,
+            folder: Path,
+            frame_format: PreviewFrame.Format,
+            detector_parameters: "Mapping[str, Any]",
+        ):
+            if not folder.is_dir():
+                raise FileNotFoundError(
+                    "The given folder '{}' does not exists.".format(folder)
+                )
+
+            self.frame_per_frames = frame_per_frames
+            self.folder = folder
+            self.frame_format = frame_format
+            self.detector_parameters = detector_parameters
+
     class ImageStream:
         class FrameWrapper:
             """
@@ -159,7 +187,7 @@ class PreviewGenerator:
             folder: Path,
             frame_size,
             frame_format: PreviewFrame.Format,
-            detector_parameters: "Mapping[str, Any]",
+            detector: "Detector_2D",
         ):
             self.frame_per_frames = frame_per_frames
             self.folder = folder
@@ -168,14 +196,7 @@ class PreviewGenerator:
             self.frame_format = frame_format
 
             self.__counter = 0
-            self.__detector = Detector_2D(settings={"pupil_size_min":40, "pupil_size_max":200, "coarse_detection":False})
-
-            # Set custom parameter for the Detector2d, if given
-            if len(detector_parameters) > 0:
-                # Update settings even if 'set_2d_detector_property' is not available
-                settings = self.__detector.get_settings()
-                settings.update(detector_parameters)
-                self.__detector = Detector_2D(settings=settings)
+            self.__detector = detector
 
         def add(self, payload) -> bool:
             self.__counter += 1
@@ -187,6 +208,9 @@ class PreviewGenerator:
                         )
                     )
 
+                import cv2
+                from methods import Roi
+
                 shape = [self.frame_size[1], self.frame_size[0]]
                 if payload["format"] != "gray":
                     shape.append(3)
@@ -258,63 +282,120 @@ class PreviewGenerator:
         def __bool__(self):
             return self.__counter > 0
 
-    def __init__(
-        self,
-        url,
-        command_pipe,
-        exception_pipe,
-        frame_per_frames: int,
-        folder: Path,
-        frame_format: PreviewFrame.Format,
-        detector_parameters: "Mapping[str, Any]",
-    ):
-        if not folder.is_dir():
-            raise FileNotFoundError(
-                "The given folder '{}' does not exists.".format(folder)
-            )
-
-        self.frame_per_frames = frame_per_frames
-        self.folder = folder
-        self.frame_format = frame_format
-        self.detector_parameters = detector_parameters
-
+    def __init__(self, url, command_pipe, exception_pipe):
         self._url = url
         self._command_pipe = command_pipe
         self._status_pipe = exception_pipe
 
     @staticmethod
     def generate(params: "PreviewGenerator"):
+        """
+        Run the worker, which serves recordings until it is told to exit.
+
+        The worker stays alive between recordings, so that the ZMQ context and
+        the detectors are kept warm for the following recordings of a session.
+        """
         try:
-            # Connect to url and read
-            params._status_pipe.send("Connecting to URL '{}'...".format(params._url))
-            context = zmq.Context()
-            frame_queue = Msg_Receiver(context, params._url, topics=("frame.eye",))
-            params._status_pipe.send(
-                "Starting generating previews and saving them in '{}'...".format(
-                    params.folder
-                )
-            )
+            import zmq
 
-            streams = {}
-            while not params._command_pipe.poll():
-                if frame_queue.new_data:
-                    topic, payload = frame_queue.recv()
-                    id = int(str(topic).split(".")[-1])
-                    if id not in streams:
-                        streams[id] = PreviewGenerator.ImageStream(
-                            eye_id=id,
-                            frame_per_frames=params.frame_per_frames,
-                            folder=params.folder,
-                            frame_size=(payload["width"], payload["height"]),
-                            frame_format=params.frame_format,
-                            detector_parameters=params.detector_parameters,
-                        )
-                    streams[id].add(payload)
+            # Load the remaining heavy modules while waiting for the first recording
+            import cv2
+            import zmq_tools
+            import pupil_detectors
+
+            context = zmq.Context()
+            detectors = {}
+
+            command = params._command_pipe.recv()
+            while command != PreviewGenerator.COMMAND_EXIT:
+                if isinstance(command, PreviewGenerator.Recording):
+                    # The command ending the recording is handled like any other
+                    command = PreviewGenerator._record(
+                        params, context, detectors, command
+                    )
+                    continue
 
-            del frame_queue
+                if command == PreviewGenerator.COMMAND_STOP:
+                    # Acknowledge the end of the recording, even without one running
+                    params._command_pipe.send(command)
+                else:
+                    params._status_pipe.send(
+                        "Ignoring unknown command '{}'.".format(command)
+                    )
+                command = params._command_pipe.recv()
         except Exception as e:
             params._status_pipe.send(e)
 
+    @staticmethod
+    def _record(
+        params: "PreviewGenerator",
+        context: "zmq.Context",
+        detectors: "MutableMapping[int, Tuple[Mapping[str, Any], Detector_2D]]",
+        recording: "PreviewGenerator.Recording",
+    ):
+        """
+        Generate the previews of a recording until the next command arrives.
+        :param params: The worker receiving the frames.
+        :param context: The ZMQ context of the worker.
+        :param detectors: The detectors built so far with their settings by eye id.
+        :param recording: The settings of the recording.
+        :return: The command which ended the recording.
+        """
+        from zmq_tools import Msg_Receiver
+
+        # Connect to url and read
+        params._status_pipe.send("Connecting to URL '{}'...".format(params._url))
+        frame_queue = Msg_Receiver(context, params._url, topics=("frame.eye",))
+        params._status_pipe.send(
+            "Starting generating previews and saving them in '{}'...".format(
+                recording.folder
+            )
+        )
+
+        streams = {}
+        while not params._command_pipe.poll():
+            if frame_queue.new_data:
+                topic, payload = frame_queue.recv()
+                id = int(str(topic).split(".")[-1])
+                if id not in streams:
+                    streams[id] = PreviewGenerator.ImageStream(
+                        eye_id=id,
+                        frame_per_frames=recording.frame_per_frames,
+                        folder=recording.folder,
+                        frame_size=(payload["width"], payload["height"]),
+                        frame_format=recording.frame_format,
+                        detector=PreviewGenerator._get_detector(
+                            detectors, id, recording.detector_parameters
+                        ),
+                    )
+                streams[id].add(payload)
+
+        del frame_queue
+        return params._command_pipe.recv()
+
+    @staticmethod
+    def _get_detector(
+        detectors: "MutableMapping[int, Tuple[Mapping[str, Any], Detector_2D]]",
+        eye_id: int,
+        detector_parameters: "Mapping[str, Any]",
+    ) -> "Detector_2D":
+        """
+        Get the detector of an eye, which is only rebuilt if its settings changed.
+        :param detectors: The detectors built so far with their settings by eye id.
+        :param eye_id: The ID of the eye.
+        :param detector_parameters: The custom parameters for the detector.
+        :return: The detector configured with the merged settings.
+        """
+        settings = dict(PreviewGenerator.DEFAULT_DETECTOR_SETTINGS)
+        settings.update(detector_parameters)
+
+        if eye_id not in detectors or detectors[eye_id][0] != settings:
+            from pupil_detectors import Detector_2D
+
+            detectors[eye_id] = (settings, Detector_2D(settings=dict(settings)))
+
+        return detectors[eye_id][1]
+
 
 class PreviewWindow:
     class WindowContextManager:
@@ -327,6 +408,8 @@ class PreviewWindow:
             self.__old_handle = None
 
         def __enter__(self):
+            import glfw
+
             self.__old_handle = glfw.glfwGetCurrentContext()
             if self.__next_handle is not None:
                 glfw.glfwMakeContextCurrent(self.__next_handle)
@@ -336,6 +419,8 @@ class PreviewWindow:
             if exc_type is not None:
                 return
 
+            import glfw
+
             glfw.glfwMakeContextCurrent(self.__old_handle)
 
     WINDOW_NAME = "Detection Preview"
@@ -359,6 +444,9 @@ class PreviewWindow:
             )
             return
 
+        import glfw
+        from gl_utils import basic_gl_setup
+
         frame_index = 0
 
         def on_key(window, key, _scancode, action, _mods):
@@ -410,12 +498,18 @@ class PreviewWindow:
         if self.__window is None:
             raise RuntimeError("Window is already closed.")
 
+        import glfw
+
         with PreviewWindow.WindowContextManager():
             glfw.glfwDestroyWindow(self.__window)
             self.__window = None
 
     @staticmethod
     def _draw_frame(window, path, frames, index: int, show_help: bool):
+        import glfw
+        from pyglui.cygl.utils import draw_gl_texture
+        from gl_utils import clear_gl_screen, make_coord_system_norm_based
+
         frames_data = [frame.load(path) for frame in frames[index]]
 
         for frame, frame_meta in zip(frames_data, frames[index]):
@@ -450,6 +544,8 @@ class PreviewWindow:
 
     @staticmethod
     def _draw_text(frame, string, position):
+        import cv2
+
         cv2.putText(
             frame,
             string,
@@ -485,7 +581,8 @@ class Preview(Plugin):
         self.__command_sender = None
         self.__worker = None
         self.__status_receiver = None
-        self.__generator = None
+        self.__recording = None
+        self.__is_recording = False
         self.__window = None
         self.__frame_format: PreviewFrame.Format = None
 
@@ -494,6 +591,8 @@ class Preview(Plugin):
         self.should_show = should_show
         self.frame_format = frame_format
 
+        self.__start_worker()
+
     @property
     def frame_format(self):
         return self.__frame_format.name
@@ -523,57 +622,70 @@ class Preview(Plugin):
                 if self.__status_receiver.poll():
                     status = self.__status_receiver.recv()
                     if isinstance(status, Exception):
+                        # The worker exits after reporting an exception
+                        self.__stop_worker()
                         raise status
                     else:
                         logger.info("{}".format(status))
-            except BrokenPipeError:
-                self.__status_receiver = None
-                self.__command_sender = None
+            except (BrokenPipeError, EOFError):
+                self.__stop_worker()
 
     def on_notify(self, notification):
         subject = notification["subject"]
-        if subject == "recording.started" and self.__worker is None:
+        if subject == "recording.started" and not self.__is_recording:
             path = self.folder
             if not path.is_absolute() or not path.is_dir():
                 recording_path = Path(notification["rec_path"])
                 path = recording_path / path
                 path.mkdir(parents=True)
 
-            self.__generator = self.__create_generator(path)
-            self.__worker = Process(
-                target=PreviewGenerator.generate, args=(self.__generator,), daemon=True
-            )
-            self.__worker.start()
+            self.__recording = self.__create_recording(path)
+            if self.__worker is None or not self.__worker.is_alive():
+                self.__start_worker()
+            try:
+                self.__command_sender.send(self.__recording)
+            except (BrokenPipeError, OSError):
+                logger.warning("The preview worker died. Restarting it.")
+                self.__stop_worker()
+                self.__start_worker()
+                self.__command_sender.send(self.__recording)
+            self.__is_recording = True
+
+        elif subject == "recording.stopped" and self.__is_recording:
+            self.__is_recording = False
+            if self.__worker is not None and self.__worker.is_alive():
+                # Keep the worker alive for further recordings
+                try:
+                    self.__command_sender.send(PreviewGenerator.COMMAND_STOP)
+                    acknowledged = (
+                        self.__command_sender.poll(3)
+                        and self.__command_sender.recv()
+                        == PreviewGenerator.COMMAND_STOP
+                    )
+                except (BrokenPipeError, EOFError, OSError):
+                    acknowledged = False
 
-        elif (
-            subject == "recording.stopped"
-            and self.__worker is not None
-            and self.__worker.is_alive()
-        ):
-            self.__command_sender.send("exit")
-            self.__worker.join(3)
-            assert self.__worker.exitcode is not None, "Joining failed."
+                if not acknowledged:
+                    logger.error(
+                        "The preview worker did not acknowledge the end of the recording. Terminating it."
+                    )
+                    self.__stop_worker()
 
             logger.info("Stopping generation of previews.")
             rough_frame_pattern = "*.{}".format(self.__frame_format)
-            if len(list(self.__generator.folder.glob(rough_frame_pattern))) == 0:
+            if len(list(self.__recording.folder.glob(rough_frame_pattern))) == 0:
                 logger.warning(
                     "No previews were generated. Was the Frame Publisher activated?!"
                 )
             elif self.should_show:
                 self.notify_all({"subject": Preview.NOTIFICATION_PREVIEW_SHOW})
 
-            # Reset process properties
-            self.__worker = None
-            self.__status_receiver = None
-            self.__command_sender = None
-
         elif (
             subject == Preview.NOTIFICATION_PREVIEW_SHOW
-            and self.__generator is not None
+            and self.__recording is not None
             and self.__window is None
         ):
-            self.__window = PreviewWindow(self, self.__generator.folder)
+            self.__window = PreviewWindow(self, self.__recording.folder)
             self.__window.show()
 
         elif (
@@ -584,6 +696,19 @@ class Preview(Plugin):
             self.__window.close()
             self.__window = None
 
+    def cleanup(self):
+        if self.__worker is not None and self.__worker.is_alive():
+            try:
+                self.__command_sender.send(PreviewGenerator.COMMAND_EXIT)
+                self.__worker.join(3)
+            except (BrokenPipeError, OSError):
+                pass
+        self.__stop_worker()
+
+        if self.__window is not None and bool(self.__window):
+            self.__window.close()
+            self.__window = None
+
     def get_init_dict(self):
         return {
             "frames_per_frame": self.frames_per_frame,
@@ -648,16 +773,31 @@ class Preview(Plugin):
 
         return parameters
 
-    def __create_generator(self, folder: Path) -> "PreviewGenerator":
-        command_receiver, self.__command_sender = Pipe(False)
-        self.__status_receiver, status_sender = Pipe(False)
-        self.__worker = None
-        return PreviewGenerator(
-            url=self.g_pool.ipc_sub_url,
-            command_pipe=command_receiver,
-            exception_pipe=status_sender,
+    def __create_recording(self, folder: Path) -> "PreviewGenerator.Recording":
+        return PreviewGenerator.Recording(
             frame_per_frames=self.frames_per_frame,
             folder=folder,
             frame_format=self.__frame_format,
             detector_parameters=self._get_detector_parameters(),
         )
+
+    def __start_worker(self):
+        command_receiver, self.__command_sender = Pipe()
+        self.__status_receiver, status_sender = Pipe(False)
+        generator = PreviewGenerator(
+            url=self.g_pool.ipc_sub_url,
+            command_pipe=command_receiver,
+            exception_pipe=status_sender,
+        )
+        self.__worker = Process(
+            target=PreviewGenerator.generate, args=(generator,), daemon=True
+        )
+        self.__worker.start()
+
+    def __stop_worker(self):
+        if self.__worker is not None and self.__worker.is_alive():
+            self.__worker.terminate()
+            self.__worker.join(1)
+        self.__worker = None
+        self.__status_receiver = None
+        self.__command_sender = None